@@ -0,0 +1,294 @@
+/*
+ * Native kernels for ML-KEM (q = 3329), loaded through ctypes by core/utils/native.py.
+ *
+ * Build (the .so stays next to this file and is picked up automatically):
+ *     cc -O3 -shared -fPIC -o core/native/_kyber_native.so core/native/_kyber_native.c
+ *
+ * The AVX2 paths are compiled through target attributes and only taken while kyber_use_avx2 is set, which defaults
+ * to what kyber_has_avx2() reports. The rest of the library stays baseline, so it loads on every CPU and falls back
+ * to the scalar paths.
+ */
+#include <stddef.h>
+#include <stdint.h>
+
+#if defined(__x86_64__) || defined(__i386__)
+#include <immintrin.h>
+#endif
+
+/* -1 until the first call detects the CPU, 0 or 1 afterwards. Writable from Python to force a path */
+int kyber_use_avx2 = -1;
+
+int kyber_has_avx2(void);
+void shake256_x4(uint8_t *out, const uint8_t *seed, const uint8_t *nonces, size_t count, size_t out_len);
+
+int kyber_has_avx2(void)
+{
+#if defined(__x86_64__) || defined(__i386__)
+    __builtin_cpu_init();
+    return __builtin_cpu_supports("avx2");
+#else
+    return 0;
+#endif
+}
+
+static int use_avx2(void)
+{
+    if (kyber_use_avx2 < 0) {
+        kyber_use_avx2 = kyber_has_avx2();
+    }
+    return kyber_use_avx2;
+}
+
+/*
+ * Keccak-f[1600] and SHAKE256 of a 32 byte seed followed by a one byte nonce, the PRF of ML-KEM.
+ */
+#define SHAKE256_RATE 136
+#define SEED_BYTES 32
+
+static const uint64_t keccak_rc[24] = {
+    0x0000000000000001ULL, 0x0000000000008082ULL, 0x800000000000808aULL, 0x8000000080008000ULL,
+    0x000000000000808bULL, 0x0000000080000001ULL, 0x8000000080008081ULL, 0x8000000000008009ULL,
+    0x000000000000008aULL, 0x0000000000000088ULL, 0x0000000080008009ULL, 0x000000008000000aULL,
+    0x000000008000808bULL, 0x800000000000008bULL, 0x8000000000008089ULL, 0x8000000000008003ULL,
+    0x8000000000008002ULL, 0x8000000000000080ULL, 0x000000000000800aULL, 0x800000008000000aULL,
+    0x8000000080008081ULL, 0x8000000000008080ULL, 0x0000000080000001ULL, 0x8000000080008008ULL,
+};
+static const unsigned keccak_rho[24] = {1, 3, 6, 10, 15, 21, 28, 36, 45, 55, 2, 14, 27, 41, 56, 8, 25, 43, 62, 18,
+                                        39, 61, 20, 44};
+static const unsigned keccak_pi[24] = {10, 7, 11, 17, 18, 3, 5, 16, 8, 21, 24, 4, 15, 23, 19, 13, 12, 2, 20, 14,
+                                       22, 9, 6, 1};
+
+/*
+ * The permutation is written once over a lane type T so the scalar and the four lane version share it. Rotations
+ * only take counts in 1..63, as keccak_rho holds.
+ */
+#define KECCAK_F1600(T, s)                                                                                           \
+    do {                                                                                                             \
+        T c[5], d, t, u;                                                                                             \
+        for (int round = 0; round < 24; round++) {                                                                   \
+            for (int x = 0; x < 5; x++) {                                                                            \
+                c[x] = s[x] ^ s[x + 5] ^ s[x + 10] ^ s[x + 15] ^ s[x + 20];                                          \
+            }                                                                                                        \
+            for (int x = 0; x < 5; x++) {                                                                            \
+                d = c[(x + 4) % 5] ^ ((c[(x + 1) % 5] << 1) | (c[(x + 1) % 5] >> 63));                               \
+                for (int y = 0; y < 25; y += 5) {                                                                    \
+                    s[x + y] ^= d;                                                                                   \
+                }                                                                                                    \
+            }                                                                                                        \
+            t = s[1];                                                                                                \
+            for (int i = 0; i < 24; i++) {                                                                           \
+                u = s[keccak_pi[i]];                                                                                 \
+                s[keccak_pi[i]] = (t << keccak_rho[i]) | (t >> (64 - keccak_rho[i]));                                \
+                t = u;                                                                                               \
+            }                                                                                                        \
+            for (int y = 0; y < 25; y += 5) {                                                                        \
+                for (int x = 0; x < 5; x++) {                                                                        \
+                    c[x] = s[y + x];                                                                                 \
+                }                                                                                                    \
+                for (int x = 0; x < 5; x++) {                                                                        \
+                    s[y + x] = c[x] ^ (~c[(x + 1) % 5] & c[(x + 2) % 5]);                                            \
+                }                                                                                                    \
+            }                                                                                                        \
+            s[0] ^= keccak_rc[round];                                                                                \
+        }                                                                                                            \
+    } while (0)
+
+static uint64_t load64(const uint8_t *x)
+{
+    uint64_t r = 0;
+    for (int i = 0; i < 8; i++) {
+        r |= (uint64_t)x[i] << (8 * i);
+    }
+    return r;
+}
+
+/* The padded single block seed || nonce || 0x1F || 0 ... || 0x80 absorbed into an all zero state */
+static void shake256_prf_lanes(uint64_t lanes[25], const uint8_t *seed, uint8_t nonce)
+{
+    for (int i = 0; i < 25; i++) {
+        lanes[i] = 0;
+    }
+    for (int i = 0; i < SEED_BYTES / 8; i++) {
+        lanes[i] = load64(seed + 8 * i);
+    }
+    lanes[SEED_BYTES / 8] = nonce | (0x1FULL << 8);
+    lanes[SHAKE256_RATE / 8 - 1] = 0x80ULL << 56;
+}
+
+static void shake256_scalar(uint8_t *out, const uint8_t *seed, uint8_t nonce, size_t out_len)
+{
+    uint64_t s[25];
+    shake256_prf_lanes(s, seed, nonce);
+    for (size_t pos = 0; pos < out_len; pos += SHAKE256_RATE) {
+        KECCAK_F1600(uint64_t, s);
+        for (size_t i = 0; i < SHAKE256_RATE && pos + i < out_len; i++) {
+            out[pos + i] = (uint8_t)(s[i / 8] >> (8 * (i % 8)));
+        }
+    }
+}
+
+#if defined(__x86_64__) || defined(__i386__)
+typedef uint64_t v4u64 __attribute__((vector_size(32)));
+
+/* Four independent SHAKE256 instances, one per 64 bit lane of every state word */
+__attribute__((target("avx2")))
+static void shake256_avx2(uint8_t *out, const uint8_t *seed, const uint8_t *nonces, size_t count, size_t out_len)
+{
+    uint64_t lanes[4][25];
+    v4u64 s[25];
+    for (size_t n = 0; n < 4; n++) {
+        /* Unused lanes repeat the first nonce and are never written out */
+        shake256_prf_lanes(lanes[n], seed, nonces[n < count ? n : 0]);
+    }
+    for (int i = 0; i < 25; i++) {
+        s[i] = (v4u64){lanes[0][i], lanes[1][i], lanes[2][i], lanes[3][i]};
+    }
+    for (size_t pos = 0; pos < out_len; pos += SHAKE256_RATE) {
+        KECCAK_F1600(v4u64, s);
+        for (size_t n = 0; n < count; n++) {
+            for (size_t i = 0; i < SHAKE256_RATE && pos + i < out_len; i++) {
+                out[n * out_len + pos + i] = (uint8_t)(s[i / 8][n] >> (8 * (i % 8)));
+            }
+        }
+    }
+}
+#endif
+
+/*
+ * out[n * out_len:(n + 1) * out_len] = SHAKE256(seed || nonces[n]) for n < count <= 4, the 32 byte seed shared by
+ * all of them. With AVX2 the count instances run together through one permutation per output block.
+ */
+void shake256_x4(uint8_t *out, const uint8_t *seed, const uint8_t *nonces, size_t count, size_t out_len)
+{
+#if defined(__x86_64__) || defined(__i386__)
+    if (use_avx2()) {
+        shake256_avx2(out, seed, nonces, count, out_len);
+        return;
+    }
+#endif
+    for (size_t n = 0; n < count; n++) {
+        shake256_scalar(out + n * out_len, seed, nonces[n], out_len);
+    }
+}
+
+/*
+ * Matrix vector product over T_q. Matrix entries are int16 in tangled layout: 128 x^0 coefficients followed by
+ * 128 x^1 coefficients, all in [0, q).
+ */
+#define KYBER_Q 3329
+#define KYBER_QINV (-3327) /* q^-1 mod 2^16 */
+#define KYBER_R2 1353      /* 2^32 mod q */
+#define KYBER_MAX_K 4      /* the int16 accumulators below hold sums of up to 4 products */
+
+void matvec(int32_t *out, const int16_t *a, const int32_t *b, const int16_t *gammas_mont, size_t rows, size_t k,
+            size_t row_stride, size_t col_stride);
+
+/* a * b * 2^-16 mod q in (-q, q) for |a * b| < q * 2^15 */
+static int16_t fqmul(int16_t a, int16_t b)
+{
+    int32_t ab = (int32_t)a * b;
+    int16_t t = (int16_t)((int16_t)ab * KYBER_QINV);
+    return (int16_t)((ab - (int32_t)t * KYBER_Q) >> 16);
+}
+
+/*
+ * One row of the product. Every term is in (-2q, 2q), so the sum over k <= 4 columns stays within int16 and is
+ * reduced once, the final multiply by 2^32 mod q cancels the 2^-16 of the products.
+ */
+static void matvec_row_scalar(int32_t *out, const int16_t *a, const int16_t *b, const int16_t *gammas_mont,
+                              size_t k, size_t col_stride)
+{
+    for (int i = 0; i < 128; i++) {
+        int16_t c0 = 0;
+        int16_t c1 = 0;
+        for (size_t j = 0; j < k; j++) {
+            const int16_t *aj = a + j * col_stride;
+            const int16_t *bj = b + 256 * j;
+            c0 += fqmul(aj[i], bj[i]) + fqmul(fqmul(aj[128 + i], bj[128 + i]), gammas_mont[i]);
+            c1 += fqmul(aj[i], bj[128 + i]) + fqmul(aj[128 + i], bj[i]);
+        }
+        c0 = fqmul(c0, KYBER_R2);
+        c1 = fqmul(c1, KYBER_R2);
+        out[2 * i] = c0 + ((c0 >> 15) & KYBER_Q);
+        out[2 * i + 1] = c1 + ((c1 >> 15) & KYBER_Q);
+    }
+}
+
+#if defined(__x86_64__) || defined(__i386__)
+__attribute__((target("avx2")))
+static inline __m256i fqmul_avx2(__m256i a, __m256i b)
+{
+    const __m256i q = _mm256_set1_epi16(KYBER_Q);
+    const __m256i qinv = _mm256_set1_epi16(KYBER_QINV);
+    __m256i lo = _mm256_mullo_epi16(a, b);
+    __m256i hi = _mm256_mulhi_epi16(a, b);
+    __m256i t = _mm256_mulhi_epi16(_mm256_mullo_epi16(lo, qinv), q);
+    return _mm256_sub_epi16(hi, t);
+}
+
+__attribute__((target("avx2")))
+static void matvec_row_avx2(int32_t *out, const int16_t *a, const int16_t *b, const int16_t *gammas_mont,
+                            size_t k, size_t col_stride)
+{
+    const __m256i q = _mm256_set1_epi16(KYBER_Q);
+    const __m256i r2 = _mm256_set1_epi16(KYBER_R2);
+    for (int i = 0; i < 128; i += 16) {
+        __m256i z = _mm256_loadu_si256((const __m256i *)(gammas_mont + i));
+        __m256i c0 = _mm256_setzero_si256();
+        __m256i c1 = _mm256_setzero_si256();
+        for (size_t j = 0; j < k; j++) {
+            const int16_t *aj = a + j * col_stride;
+            const int16_t *bj = b + 256 * j;
+            __m256i a0 = _mm256_loadu_si256((const __m256i *)(aj + i));
+            __m256i a1 = _mm256_loadu_si256((const __m256i *)(aj + 128 + i));
+            __m256i b0 = _mm256_loadu_si256((const __m256i *)(bj + i));
+            __m256i b1 = _mm256_loadu_si256((const __m256i *)(bj + 128 + i));
+            c0 = _mm256_add_epi16(c0, _mm256_add_epi16(fqmul_avx2(a0, b0), fqmul_avx2(fqmul_avx2(a1, b1), z)));
+            c1 = _mm256_add_epi16(c1, _mm256_add_epi16(fqmul_avx2(a0, b1), fqmul_avx2(a1, b0)));
+        }
+        c0 = fqmul_avx2(c0, r2);
+        c1 = fqmul_avx2(c1, r2);
+        c0 = _mm256_add_epi16(c0, _mm256_and_si256(_mm256_srai_epi16(c0, 15), q));
+        c1 = _mm256_add_epi16(c1, _mm256_and_si256(_mm256_srai_epi16(c1, 15), q));
+        /* Interleave back to (c0, c1) pairs; unpack works per 128-bit lane, the permutes restore the order */
+        __m256i lo = _mm256_unpacklo_epi16(c0, c1);
+        __m256i hi = _mm256_unpackhi_epi16(c0, c1);
+        __m256i first = _mm256_permute2x128_si256(lo, hi, 0x20);
+        __m256i second = _mm256_permute2x128_si256(lo, hi, 0x31);
+        _mm256_storeu_si256((__m256i *)(out + 2 * i), _mm256_cvtepi16_epi32(_mm256_castsi256_si128(first)));
+        _mm256_storeu_si256((__m256i *)(out + 2 * i + 8), _mm256_cvtepi16_epi32(_mm256_extracti128_si256(first, 1)));
+        _mm256_storeu_si256((__m256i *)(out + 2 * i + 16), _mm256_cvtepi16_epi32(_mm256_castsi256_si128(second)));
+        _mm256_storeu_si256((__m256i *)(out + 2 * i + 24),
+                            _mm256_cvtepi16_epi32(_mm256_extracti128_si256(second, 1)));
+    }
+}
+#endif
+
+/*
+ * out[r] = sum_j a[r][j] * b[j] in T_q for r < rows and j < k <= 4. The entry a[r][j] starts at
+ * a + r * row_stride + j * col_stride (in int16 elements), so a transposed matrix is read in place. b holds k elements
+ * of 256 int32 in [0, q) with interleaved coefficients, out receives rows elements the same way. gammas_mont holds the
+ * 128 base case constants times 2^16 mod q.
+ */
+void matvec(int32_t *out, const int16_t *a, const int32_t *b, const int16_t *gammas_mont, size_t rows, size_t k,
+            size_t row_stride, size_t col_stride)
+{
+    int16_t b_tangled[KYBER_MAX_K * 256];
+
+    for (size_t j = 0; j < k; j++) {
+        for (int i = 0; i < 128; i++) {
+            b_tangled[256 * j + i] = (int16_t)b[256 * j + 2 * i];
+            b_tangled[256 * j + 128 + i] = (int16_t)b[256 * j + 2 * i + 1];
+        }
+    }
+
+    for (size_t r = 0; r < rows; r++) {
+#if defined(__x86_64__) || defined(__i386__)
+        if (use_avx2()) {
+            matvec_row_avx2(out + 256 * r, a + r * row_stride, b_tangled, gammas_mont, k, col_stride);
+            continue;
+        }
+#endif
+        matvec_row_scalar(out + 256 * r, a + r * row_stride, b_tangled, gammas_mont, k, col_stride);
+    }
+}
@@ -1,8 +1,36 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
+
 import numpy as np
 
-from core.utils.bits import byte_encode, byte_decode, compress, decompress
-from core.utils.hash import sha3_512, prf
-from core.utils.ntt import NTT
+from core.utils.bits import byte_encode_into, byte_decode, compress_encode_into, decompress_decode
+from core.utils.hash import sha3_512, prf_x4
+from core.utils.ntt import NTT, barrett_reduce, tangle
+
+# One byte encodings of the matrix indices and PRF nonces, shared by all KPke objects
+_IDX = [n.to_bytes(1, 'little') for n in range(64)]
+
+# CPUs this process may run on, the thread pool only pays off with more than one
+_CPU_COUNT = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    """
+    Returns the thread pool shared by all KPke objects, created on first use
+
+    :return: ThreadPoolExecutor with one worker per usable cpu
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=_CPU_COUNT)
+    return _executor
 
 
 class KPke:
@@ -17,6 +45,8 @@ class KPke:
         self.k = const.K
         self.encryption_key = None
         self.decryption_key = None
+        # (ro, A) of the last sampled matrix, replaced as a whole so readers never pair a seed with another matrix
+        self._A_cache = None
 
     def keygen(self, d):
         """
@@ -31,25 +61,22 @@ class KPke:
 
         assert len(d) == 32, f"Length of random bytes {32}bytes. Not {len(d)}"
 
-        ro, sigma = sha3_512(d + self.k.to_bytes())
-        n = 0
-        s = [[0] * self.const.N for _ in range(self.k)]
-        e = [[0] * self.const.N for _ in range(self.k)]
-        A = [[[0] * self.const.N for _ in range(self.k)] for _ in range(self.k)]
+        ro, sigma = sha3_512(d + _IDX[self.k])
+        A = self._sample_matrix(ro)
+        # s and e share eta, so their 2k PRF calls are batched together
+        se_cap = self.ntt.ntt(self._sample_noise(sigma, 0, 2 * self.k, self.const.ETA))
+        s_cap, e_cap = se_cap[:self.k], se_cap[self.k:]
+        # Coefficients stay below 2q until this single reduction ahead of encoding
+        t_cap = self._reduce(self._add_vectors(self._multiply_array_vector_modified(A, s_cap), e_cap))
+        encryption_key = bytearray(384 * self.k + 32)
+        decryption_key = bytearray(384 * self.k)
+        ek_view, dk_view = memoryview(encryption_key), memoryview(decryption_key)
         for i in range(self.k):
-            for j in range(self.k):
-                A[i][j] = self.ntt.get_sample_ntt(ro + j.to_bytes() + i.to_bytes())
-        for i in range(self.k):
-            s[i] = self.ntt.get_sample_polyCBD(prf(sigma, n.to_bytes(), self.const.ETA), self.const.ETA)
-            n += 1
-        for j in range(self.k):
-            e[j] = self.ntt.get_sample_polyCBD(prf(sigma, n.to_bytes(), self.const.ETA), self.const.ETA)
-            n += 1
-        s_cap = [self.ntt.ntt(s[i]) for i in range(self.k)]
-        e_cap = [self.ntt.ntt(e[i]) for i in range(self.k)]
-        t_cap = self._add_vectors(self._multiply_array_vector_modified(A, s_cap), e_cap)
-        self.encryption_key = b''.join([byte_encode(t_cap[i], 12) for i in range(self.k)]) + ro
-        self.decryption_key = b''.join([byte_encode(s_cap[i], 12) for i in range(self.k)])
+            byte_encode_into(t_cap[i], 12, ek_view[i * 384: (i + 1) * 384])
+            byte_encode_into(s_cap[i], 12, dk_view[i * 384: (i + 1) * 384])
+        ek_view[384 * self.k:] = ro
+        self.encryption_key = bytes(encryption_key)
+        self.decryption_key = bytes(decryption_key)
         return self.encryption_key, self.decryption_key
 
     def encrypt(self, message, randomness, encryption_key):
@@ -66,34 +93,30 @@ class KPke:
         assert len(message) == 32 and len(randomness) == 32, f"Length of message and randomness should be {32} bytes."
 
         self.encryption_key = encryption_key
-        A = [[[0] * self.const.N for _ in range(self.k)] for _ in range(self.k)]
-        n = 0
-        t_cap = [byte_decode(self.encryption_key[i * 384: (i + 1) * 384], self.const.D) for i in range(self.k)]
+        t_cap = np.array([byte_decode(self.encryption_key[i * 384: (i + 1) * 384], self.const.D)
+                          for i in range(self.k)])
         ro = self.encryption_key[384 * self.k: 384 * self.k + 32]
+        A = self._sample_matrix(ro)
+        if self.const.ETA == self.const.ETA_2:
+            noise = self._sample_noise(randomness, 0, 2 * self.k + 1, self.const.ETA)
+        else:
+            noise = np.concatenate([self._sample_noise(randomness, 0, self.k, self.const.ETA),
+                                    self._sample_noise(randomness, self.k, self.k + 1, self.const.ETA_2)])
+        y, e1, e2 = noise[:self.k], noise[self.k:2 * self.k], noise[2 * self.k]
+        y_cap = self.ntt.ntt(y)
+        # u and v leave the NTT domain together in a single inverse transform of k + 1 polynomials
+        uv = self.ntt.ntt_inverse(np.concatenate([self._multiply_array_transpose_vector(A, y_cap),
+                                                  self._multiply_vector_vector(t_cap, y_cap)[np.newaxis]]))
+        u = self._reduce(self._add_vectors(uv[:self.k], e1))
+        mu = decompress_decode(message, 1)
+        v = self._reduce(self._add_vectors(self._add_vectors(uv[self.k], e2), mu))
+        du, dv = self.const.DU, self.const.DV
+        cipher = bytearray(32 * (du * self.k + dv))
+        view = memoryview(cipher)
         for i in range(self.k):
-            for j in range(self.k):
-                A[i][j] = self.ntt.get_sample_ntt(ro + j.to_bytes() + i.to_bytes())
-        y = [[0] * self.const.N for _ in range(self.k)]
-        e1 = [[0] * self.const.N for _ in range(self.k)]
-        for i in range(self.k):
-            y[i] = self.ntt.get_sample_polyCBD(prf(randomness, n.to_bytes(), self.const.ETA), self.const.ETA)
-            n += 1
-        for j in range(self.k):
-            e1[j] = self.ntt.get_sample_polyCBD(prf(randomness, n.to_bytes(), self.const.ETA_2), self.const.ETA_2)
-            n += 1
-        e2 = self.ntt.get_sample_polyCBD(prf(randomness, n.to_bytes(), self.const.ETA_2), self.const.ETA_2)
-        y_cap = [self.ntt.ntt(y[i]) for i in range(self.k)]
-        u = self._multiply_array_transpose_vector(A, y_cap)
-        u = [self.ntt.ntt_inverse(u[i]) for i in range(self.k)]
-        u = [self._add_vectors(u[i], e1[i]) for i in range(self.k)]
-        mu = decompress(byte_decode(message, 1), 1)
-        v = self.ntt.ntt_inverse(self._multiply_vector_vector(t_cap, y_cap))
-        v = self._add_vectors(self._add_vectors(v, e2), mu)
-        first_half_cipher = [byte_encode(compress(u[i], self.const.DU), self.const.DU) for i in range(self.k)]
-        second_half_cipher = byte_encode(compress(v, self.const.DV), self.const.DV)
-        cipher = b''.join(first_half_cipher)
-        cipher += second_half_cipher
-        return cipher
+            compress_encode_into(u[i], du, view[32 * du * i: 32 * du * (i + 1)])
+        compress_encode_into(v, dv, view[32 * du * self.k:])
+        return bytes(cipher)
 
     def decrypt(self, cipher, decryption_key):
         """
@@ -107,35 +130,93 @@ class KPke:
         self.decryption_key = decryption_key
         first_half = cipher[0:32 * self.const.DU * self.k]
         second_half = cipher[32 * self.const.DU * self.k:]
-        u = [decompress(byte_decode(first_half[32 * self.const.DU * i: 32 * self.const.DU * (i + 1)], self.const.DU),
-                        self.const.DU) for i in range(self.k)]
-        v = decompress(byte_decode(second_half, self.const.DV), self.const.DV)
-        s_cap = [byte_decode(self.decryption_key[i * 384: (i + 1) * 384], 12) for i in range(self.k)]
-        u_cap = [self.ntt.ntt(u[i]) for i in range(self.k)]
+        u = np.array([decompress_decode(first_half[32 * self.const.DU * i: 32 * self.const.DU * (i + 1)],
+                                        self.const.DU) for i in range(self.k)])
+        v = decompress_decode(second_half, self.const.DV)
+        s_cap = np.array([byte_decode(self.decryption_key[i * 384: (i + 1) * 384], 12) for i in range(self.k)])
+        u_cap = self.ntt.ntt(u)
         w = self.ntt.ntt_inverse(self._multiply_vector_vector(s_cap, u_cap))
-        w = np.subtract(v, w) % self.const.Q
-        message = byte_encode(compress(w, 1), 1)
-        return message
+        w = self._sub_vectors(v, w)
+        message = bytearray(32)
+        compress_encode_into(w, 1, message)
+        return bytes(message)
+
+    def _sample_matrix(self, ro):
+        """
+        Samples the matrix A in NTT form from the seed ro. The last sampled matrix is cached, keygen and encrypt
+        (including the re-encryption in decapsulation) under the same key skip the k^2 SHAKE128 calls
+
+        :param ro: (Byte) 32 byte public seed
+
+        :return: Read-only int16 array of shape (k, k, 2, 128), kept in tangled layout for the base case multiply
+        """
+        cache = self._A_cache
+        if cache is not None and cache[0] == ro:
+            return cache[1]
+
+        seeds = [ro + _IDX[j] + _IDX[i] for i, j in product(range(self.k), repeat=2)]
+        # int16 holds Z_q and is what the native matvec reads in place, the other backends widen it themselves
+        A = np.ascontiguousarray(tangle(np.array(self._map(self.ntt.get_sample_ntt, seeds))), dtype=np.int16).reshape(
+            self.k, self.k, 2, self.const.N // 2)
+        A.flags.writeable = False
+        self._A_cache = (bytes(ro), A)
+        return A
+
+    def _sample_noise(self, seed, start, count, eta):
+        """
+        Samples count polynomials from D_eta(R_q) using the PRF nonces start, ..., start + count - 1, evaluated in
+        batches of four
+
+        :param seed: (Byte) 32 byte PRF seed
+        :param start: first PRF nonce
+        :param count: number of polynomials
+        :param eta: parameter of the centered binomial distribution
+
+        :return: Array of shape (count, 256)
+        """
+        def sample(nonces):
+            return [self.ntt.get_sample_polyCBD(b, eta) for b in prf_x4(seed, [_IDX[n] for n in nonces], eta)]
+
+        batches = [range(n, min(n + 4, start + count)) for n in range(start, start + count, 4)]
+        if len(batches) == 1:
+            return np.array(sample(batches[0]))
+        return np.array([f for batch in self._map(sample, batches) for f in batch])
+
+    def _map(self, func, items):
+        """
+        Applies func to every item, on the shared thread pool for k > 2 when more than one cpu is usable (pycryptodome
+        calls Keccak through ctypes, which releases the GIL). For k = 2 or a single cpu the thread hand-off costs more
+        than it saves, so it runs serially
+
+        :param func: function of one argument
+        :param items: iterable of arguments
+
+        :return: List of results in the order of items
+        """
+        if self.k > 2 and _CPU_COUNT > 1:
+            return list(_get_executor().map(func, items))
+        return list(map(func, items))
 
     def _multiply_vector_vector(self, vec1, vec2):
-        result = [0] * self.const.N
-        for i in range(self.k):
-            result = self._add_vectors(self.ntt.multiply_ntt(vec1[i], vec2[i]), result)
-        return result
+        return self.ntt.batched_multiply_ntt(tangle(vec1)[np.newaxis], vec2)[0]
 
     def _multiply_array_vector_modified(self, array, vector):
-        result = [[0] * self.const.N for _ in range(self.k)]
-        for i in range(self.k):
-            for j in range(self.k):
-                result[i] = self._add_vectors(self.ntt.multiply_ntt(array[i][j], vector[j]), result[i])
-        return result
+        return self.ntt.batched_multiply_ntt(array, vector)
 
     def _multiply_array_transpose_vector(self, array, vector):
-        result = [[0] * self.const.N for _ in range(self.k)]
-        for i in range(self.k):
-            for j in range(self.k):
-                result[i] = self._add_vectors(self.ntt.multiply_ntt(array[j][i], vector[j]), result[i])
-        return result
+        return self.ntt.batched_multiply_ntt(array.transpose(1, 0, 2, 3), vector)
 
     def _add_vectors(self, vec1, vec2):
-        return np.add(vec1, vec2) % self.const.Q
+        # No reduction, sums of a few terms in [0, q) stay far below 2^31. Callers reduce once with _reduce
+        return np.add(vec1, vec2, dtype=np.int32)
+
+    def _sub_vectors(self, vec1, vec2):
+        # Inputs must be in [0, q), the difference is in (-q, q) and one branchless conditional add reduces it
+        result = np.subtract(vec1, vec2, dtype=np.int32)
+        result += (result >> 31) & self.const.Q
+        return result
+
+    def _reduce(self, vec):
+        # barrett_reduce is specialised to q = 3329, true for every ML-KEM parameter set
+        assert self.const.Q == 3329, f"barrett_reduce requires q = 3329. Not {self.const.Q}."
+        return barrett_reduce(vec)
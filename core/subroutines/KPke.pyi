@@ -1,8 +1,16 @@
-from typing import Tuple, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, List, Tuple
+
+import numpy as np
+
 import core.constants_ as cons
 from core.utils.ntt import NTT
 
-Matrix = List[List[int]]
+Matrix = np.ndarray
+
+_IDX: List[bytes]
+
+def _get_executor() -> ThreadPoolExecutor: ...
 
 class KPke:
     def __init__(self, const: cons) -> None:
@@ -11,6 +19,7 @@ class KPke:
         self.const: cons = None
         self.encryption_key: bytes = None
         self.decryption_key: bytes = None
+        self._A_cache: Tuple[bytes, Matrix] | None = None
         ...
 
     def keygen(self, d: bytes) -> Tuple[bytes, bytes]: ...
@@ -19,10 +28,20 @@ class KPke:
 
     def decrypt(self, cipher: bytes, decryption_key: bytes) -> bytes: ...
 
-    def _multiply_vector_vector(self, vec1: Matrix, vec2: Matrix) -> List[int]: ...
+    def _sample_matrix(self, ro: bytes) -> Matrix: ...
+
+    def _sample_noise(self, seed: bytes, start: int, count: int, eta: int) -> Matrix: ...
+
+    def _map(self, func: Callable[[Any], Any], items: Iterable[Any]) -> List[Any]: ...
+
+    def _multiply_vector_vector(self, vec1: Matrix, vec2: Matrix) -> np.ndarray: ...
+
+    def _multiply_array_vector_modified(self, array: Matrix, vector: Matrix) -> Matrix: ...
+
+    def _multiply_array_transpose_vector(self, array: Matrix, vector: Matrix) -> Matrix: ...
 
-    def _multiply_array_vector_modified(self, array: List[Matrix], vector: Matrix) -> Matrix: ...
+    def _add_vectors(self, vec1: Matrix, vec2: Matrix) -> Matrix: ...
 
-    def _multiply_array_transpose_vector(self, array: List[Matrix], vector: Matrix) -> Matrix: ...
+    def _sub_vectors(self, vec1: Matrix, vec2: Matrix) -> Matrix: ...
 
-    def _add_vectors(self, vec1: Matrix | List[int], vec2: Matrix | List[int]) -> Matrix | List[int]: ...
+    def _reduce(self, vec: Matrix) -> Matrix: ...
@@ -1,14 +1,23 @@
 from typing import List, Optional
 
+import numpy as np
+
 def bits_to_bytes(bit_array: List[int]) -> bytes: ...
 
 def bytes_to_bits(byte_array: bytes) -> List[int]: ...
 
-def byte_encode(f: List[int], d: int) -> bytes: ...
+def byte_encode(f: List[int] | np.ndarray, d: int) -> bytes: ...
+
+def byte_encode_into(f: List[int] | np.ndarray, d: int, out: memoryview | bytearray) -> None: ...
+
+def _pack(f: List[int] | np.ndarray, d: int) -> np.ndarray: ...
+
+def byte_decode(byte_array: bytes, d: int) -> np.ndarray: ...
 
-def byte_decode(byte_array: bytes, d: int) -> List[int]: ...
+def compress(x: List[int] | np.ndarray, d: int, q: Optional[int] = 3329) -> np.ndarray: ...
 
-def compress(x: List[int],d: int,q: Optional[int] = 3329) -> List[int]: ...
+def decompress(y: List[int] | np.ndarray, d: int, q: Optional[int] = 3329) -> np.ndarray: ...
 
-def decompress(y:List[int], d:int, q: Optional[int] = 3329) -> List[int]: ...
+def compress_encode_into(x: List[int] | np.ndarray, d: int, out: memoryview | bytearray, q: Optional[int] = 3329) -> None: ...
 
+def decompress_decode(byte_array: bytes, d: int, q: Optional[int] = 3329) -> np.ndarray: ...
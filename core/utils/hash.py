@@ -1,5 +1,7 @@
 from Crypto.Hash import SHAKE128, SHAKE256, SHA3_512, SHA3_256
 
+from core.utils.native import HAS_NATIVE, shake256_x4
+
 
 def shake128(strings, byte_lengths):
     """
@@ -43,6 +45,24 @@ def prf(byte_string, b, eta):
     return shake_256.read(64 * eta)
 
 
+def prf_x4(byte_string, bs, eta):
+    """
+    Evaluates prf(byte_string, b, eta) for a batch of up to four nonces. With the _kyber_native library the SHAKE256
+    instances run side by side in the lanes of one Keccak permutation, otherwise prf is called once per nonce.
+
+    :param byte_string: 32 byte seed shared by the batch.
+    :param bs: List of 1 to 4 single byte nonces.
+    :param eta: Parameter of the output length 64 * eta.
+
+    :return: List of outputs, one per nonce.
+    """
+    assert 1 <= len(bs) <= 4, f"Batch must hold 1 to 4 nonces. Not {len(bs)}."
+
+    if HAS_NATIVE:
+        return shake256_x4(byte_string, b''.join(bs), 64 * eta)
+    return [prf(byte_string, b, eta) for b in bs]
+
+
 def shake256(ctx):
     shake_256 = SHAKE256.new(ctx)
     return shake_256.read(32)
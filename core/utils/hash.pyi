@@ -8,4 +8,6 @@ def sha3_256(ctx: bytes) -> bytes: ...
 
 def prf(byte_string: bytes, b: bytes, eta: int) -> bytes: ...
 
+def prf_x4(byte_string: bytes, bs: List[bytes], eta: int) -> List[bytes]: ...
+
 def shake256(ctx: bytes) -> bytes: ...
@@ -0,0 +1,21 @@
+import os
+
+# Numba is opt-in: importing it and loading the compiled kernels costs far more than a one-shot process saves
+USE_NUMBA = False
+if os.environ.get('PQC_NUMBA') == '1':
+    try:
+        from numba import njit
+        USE_NUMBA = True
+    except ImportError:
+        pass
+
+if not USE_NUMBA:
+    def njit(*args, **kwargs):
+        """
+        Stand-in for numba.njit when the JIT is disabled or numba is not installed, returns the function unchanged
+
+        :return: The decorated function or a decorator
+        """
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
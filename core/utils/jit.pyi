@@ -0,0 +1,5 @@
+from typing import Any, Callable
+
+USE_NUMBA: bool
+
+def njit(*args: Any, **kwargs: Any) -> Callable: ...
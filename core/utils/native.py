@@ -0,0 +1,78 @@
+import ctypes
+import os
+
+import numpy as np
+
+_LIBRARY_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'native',
+                             '_kyber_native.so')
+
+
+def _load():
+    """
+    Loads the optional _kyber_native library built from core/native/_kyber_native.c. It runs on every cpu, its
+    kernels take the AVX2 paths when the cpu has AVX2 and scalar code otherwise
+
+    :return: The library, or None when it is not built
+    """
+    try:
+        lib = ctypes.CDLL(_LIBRARY_PATH)
+    except OSError:
+        return None
+
+    # Plain addresses: ndpointer's per-argument checks cost several times the kernels, the wrappers assert instead
+    pointer, size = ctypes.c_void_p, ctypes.c_size_t
+    lib.shake256_x4.argtypes = [ctypes.c_char_p, ctypes.c_char_p, ctypes.c_char_p, size, size]
+    lib.shake256_x4.restype = None
+    lib.matvec.argtypes = [pointer, pointer, pointer, pointer, size, size, size, size]
+    lib.matvec.restype = None
+    return lib
+
+
+_lib = _load()
+HAS_NATIVE = _lib is not None
+
+
+def shake256_x4(seed, nonces, out_len):
+    """
+    Computes SHAKE256(seed || nonce) for up to four nonces at once, the instances share the lanes of one Keccak
+    permutation per output block
+
+    :param seed: 32 byte seed shared by all instances
+    :param nonces: 1 to 4 single byte nonces, as one bytes object
+    :param out_len: Output length of every instance in bytes
+
+    :return: List of the outputs, one per nonce
+    """
+    assert HAS_NATIVE, "The _kyber_native library is not available."
+    assert len(seed) == 32, f"The seed must be 32 bytes in length. Not {len(seed)}."
+    assert 1 <= len(nonces) <= 4, f"Batch must hold 1 to 4 nonces. Not {len(nonces)}."
+
+    out = ctypes.create_string_buffer(len(nonces) * out_len)
+    _lib.shake256_x4(out, bytes(seed), bytes(nonces), len(nonces), out_len)
+    raw = out.raw
+    return [raw[n * out_len: (n + 1) * out_len] for n in range(len(nonces))]
+
+
+def matvec(out, array, vector, gammas_mont):
+    """
+    Matrix vector product of elements of T_q, out[r] = sum_j array[r][j] * vector[j]. The accumulation over j stays
+    in C and the matrix is read through its strides, so a transposed view costs no copy
+
+    :param out: int32 array of shape (rows, 256) receiving the products with interleaved coefficients
+    :param array: int16 array of shape (rows, k, 2, 128) in tangled layout, coefficients in [0, q), k <= 4. The
+        (2, 128) entries must be contiguous, the two outer axes may have any non-negative strides
+    :param vector: int32 array of shape (k, 256) with interleaved coefficients in [0, q)
+    :param gammas_mont: int16 array of the 128 base case constants times 2^16 mod q
+    """
+    assert HAS_NATIVE, "The _kyber_native library is not available."
+    rows, k = array.shape[0], array.shape[1]
+    assert k <= 4, f"The native matvec supports k <= 4. Not {k}."
+    assert array.dtype == np.int16 and gammas_mont.dtype == np.int16, "array and gammas_mont must be int16."
+    assert out.dtype == np.int32 and vector.dtype == np.int32, "out and vector must be int32."
+    assert array.strides[2:] == (256, 2) and min(array.strides[:2]) >= 0, "Entries of array must be contiguous."
+    assert out.flags.c_contiguous and vector.flags.c_contiguous, "out and vector must be contiguous."
+    assert out.shape == (rows, 256), f"Shape of out must be {(rows, 256)}. Not {out.shape}."
+    assert vector.shape == (k, 256), f"Shape of vector must be {(k, 256)}. Not {vector.shape}."
+
+    _lib.matvec(out.ctypes.data, array.ctypes.data, vector.ctypes.data, gammas_mont.ctypes.data, rows, k,
+                array.strides[0] // 2, array.strides[1] // 2)
@@ -0,0 +1,9 @@
+from typing import List
+
+import numpy as np
+
+HAS_NATIVE: bool
+
+def shake256_x4(seed: bytes, nonces: bytes, out_len: int) -> List[bytes]: ...
+
+def matvec(out: np.ndarray, array: np.ndarray, vector: np.ndarray, gammas_mont: np.ndarray) -> None: ...
@@ -1,6 +1,72 @@
-from core.utils.bits import bytes_to_bits
+import numpy as np
+
+from core.utils.jit import USE_NUMBA, njit
+from core.utils.native import HAS_NATIVE, matvec
 from Crypto.Hash import SHAKE128
 
+# Shift of the floor(2^32 / q) multiplier used by the Numba base case multiply (NTT.barrett_m)
+_MUL_REDUCE_SHIFT = 32
+
+# barrett_reduce is specialised to q = 3329: multiplier floor(2^24 / q) with shift 24
+_REDUCE_Q = 3329
+_REDUCE_SHIFT = 24
+_REDUCE_MULTIPLIER = (1 << _REDUCE_SHIFT) // _REDUCE_Q
+
+
+def barrett_reduce(x):
+    """
+    Reduces an int32 array modulo q = 3329 (only) with a Barrett multiply-shift, t = (x * 5039) >> 24, instead of an
+    integer division. The arithmetic shift floors negative values too, so any -q <= x < 2^31 / 5039 (~4.2 * 10^5) is
+    handled.
+
+    :param x: Array of integers in [-q, 426171].
+
+    :return: int32 array of x mod q in [0, q).
+    """
+    x = np.asarray(x, dtype=np.int32)
+    r = x - ((x * _REDUCE_MULTIPLIER) >> _REDUCE_SHIFT) * _REDUCE_Q
+    return r - (_REDUCE_Q & ~((r - _REDUCE_Q) >> 31))
+
+
+@njit(cache=True)
+def _reduce_u32(x, q, m):
+    """
+    Reduces 0 <= x < 2^32 modulo q with a multiply-shift, m = floor(2^32 / q)
+    """
+    r = x - ((x * m) >> _MUL_REDUCE_SHIFT) * q
+    return r - q if r >= q else r
+
+
+@njit(cache=True)
+def _batched_basemul(array, vector, gammas, q, m, out):
+    """
+    Matrix vector product of elements of T_q into out, the matrix is in tangled layout
+    """
+    for r in range(array.shape[0]):
+        for i in range(128):
+            c0 = np.int64(0)
+            c1 = np.int64(0)
+            for j in range(array.shape[1]):
+                a0, a1 = np.int64(array[r, j, 0, i]), np.int64(array[r, j, 1, i])
+                b0, b1 = np.int64(vector[j, 2 * i]), np.int64(vector[j, 2 * i + 1])
+                c0 += _reduce_u32(a0 * b0 + _reduce_u32(a1 * b1, q, m) * gammas[i], q, m)
+                c1 += a0 * b1 + a1 * b0
+            out[r, 2 * i] = _reduce_u32(c0, q, m)
+            out[r, 2 * i + 1] = _reduce_u32(c1, q, m)
+
+
+def tangle(f_cap):
+    """
+    Splits elements of T_q into the planes of x^0 and x^1 coefficients of the 128 degree one factors, the layout the
+    base case multiply reads with contiguous loads
+
+    :param f_cap: Array of shape (..., 256) with interleaved NTT coefficients
+
+    :return: Array of shape (..., 2, 128)
+    """
+    f_cap = np.asarray(f_cap)
+    return f_cap.reshape(*f_cap.shape[:-1], 128, 2).swapaxes(-1, -2)
+
 
 class NTT:
     """
@@ -13,56 +79,62 @@ class NTT:
         self.n = const.N
         self.q = const.Q
         self.eta = const.ETA
+        self.zetas = np.array(self.zeta_values, dtype=np.int32)
+        self.gammas = np.array(self.zeta_double_value, dtype=np.int64) % self.q
+        # Base case constants in the Montgomery domain of the native kernel, gamma * 2^16 mod q
+        self.gammas_mont = ((self.gammas << 16) % self.q).astype(np.int16)
+        self.barrett_m = (1 << _MUL_REDUCE_SHIFT) // self.q
 
     def ntt(self, f):
         """
-        Computes the NTT of a given polynomial f.
+        Computes the NTT of a given polynomial f. Every layer runs as one vectorized butterfly over all of its blocks,
+        and over all polynomials when a stack of them is given.
 
-        :param f: Array of polynomial coefficients in Z_q (length 256).
+        :param f: Array of polynomial coefficients in Z_q (length 256), or a stack of them of shape (..., 256).
 
-        :return: Array of NTT coefficients f_cap in Z_q.
+        :return: Array of NTT coefficients f_cap in Z_q, same shape as f.
         """
+        f_cap = np.array(f, dtype=np.int32)
+        assert f_cap.shape[-1] == 256, f"Length of array f should be {256}, Not {f_cap.shape[-1]}"
 
-        assert len(f) == 256, f"Length of array f should be {256}, Not {len(f)}"
-
-        f_cap = f.copy()
         i = 1
         length = 128
         while length >= 2:
-            for start in range(0, 256, 2 * length):
-                zeta = self.zeta_values[i]
-                i += 1
-                for j in range(start, start + length):
-                    t = (zeta * f_cap[j + length]) % self.q
-                    f_cap[j + length] = (f_cap[j] - t) % self.q
-                    f_cap[j] = (f_cap[j] + t) % self.q
+            blocks = 128 // length
+            zetas = self.zetas[i: i + blocks].reshape(blocks, 1)
+            i += blocks
+            f_blocks = f_cap.reshape(*f_cap.shape[:-1], blocks, 2, length)
+            t = (zetas * f_blocks[..., 1, :]) % self.q
+            f_blocks[..., 1, :] = (f_blocks[..., 0, :] - t) % self.q
+            f_blocks[..., 0, :] = (f_blocks[..., 0, :] + t) % self.q
             length //= 2
         return f_cap
 
     def ntt_inverse(self, f_cap):
         """
-        Computes the inverse NTT (NTT_Inverse) of a given NTT representation f_cap.
+        Computes the inverse NTT (NTT_Inverse) of a given NTT representation f_cap, vectorized per layer like ntt.
 
-        :param f_cap: Array of NTT coefficients in Z_q (length 256).
+        :param f_cap: Array of NTT coefficients in Z_q (length 256), or a stack of them of shape (..., 256).
 
-        :return: Array of polynomial coefficients f in Z_q.
+        :return: Array of polynomial coefficients f in Z_q, same shape as f_cap.
         """
-        assert len(f_cap) == 256, f"Length of f_cap must be 256. Not {len(f_cap)}."
-        f = f_cap.copy()
+        f = np.array(f_cap, dtype=np.int32)
+        assert f.shape[-1] == 256, f"Length of f_cap must be 256. Not {f.shape[-1]}."
+
         i = 127
         length = 2
         while length <= 128:
-            for start in range(0, 256, 2 * length):
-                zeta = self.zeta_values[i]
-                i -= 1
-                for j in range(start, start + length):
-                    t = f[j]  # Save the value of f[j]
-                    f[j] = (t + f[j + length]) % self.q  # f[j] = f[j] + f[j + length]
-                    f[j + length] = (zeta * (f[j + length] - t)) % self.q  # f[j+length] = zeta * (f[j+length] - t)
+            blocks = 128 // length
+            # Blocks are visited left to right while the zeta index counts down
+            zetas = self.zetas[i - blocks + 1: i + 1][::-1].reshape(blocks, 1)
+            i -= blocks
+            f_blocks = f.reshape(*f.shape[:-1], blocks, 2, length)
+            t = f_blocks[..., 0, :].copy()
+            f_blocks[..., 0, :] = (t + f_blocks[..., 1, :]) % self.q
+            f_blocks[..., 1, :] = (zetas * (f_blocks[..., 1, :] - t)) % self.q
             length *= 2
         scale_factor = 3303
-        f = [(x * scale_factor) % self.q for x in f]
-        return f
+        return (f * scale_factor) % self.q
 
     def _base_case_multiply(self, a0, a1, b0, b1, zeta):
         """
@@ -92,12 +164,52 @@ class NTT:
         assert len(f_cap) == 256 and len(g_cap) == 256, (f" Length of f_cap and g_cap must be 256. Not {len(f_cap)} and"
                                                          f" {len(g_cap)}.")
 
+        f_cap = np.asarray(f_cap).tolist()
+        g_cap = np.asarray(g_cap).tolist()
         h_cap = [0] * 256
         for i in range(128):
             h_cap[2 * i], h_cap[2 * i + 1] = self._base_case_multiply(f_cap[2 * i], f_cap[2 * i + 1],
                                                                       g_cap[2 * i], g_cap[2 * i + 1],
                                                                       self.zeta_double_value[i])
-        return h_cap
+        return np.array(h_cap, dtype=np.int32)
+
+    def batched_multiply_ntt(self, array, vector):
+        """
+        Computes the matrix vector product of elements from T_q, i.e. sum_j array[i][j] * vector[j] for every row i,
+        as a single broadcast base case multiply over all rows and columns
+
+        :param array: Array of shape (rows, k, 2, 128) with elements from T_q in tangled layout (see tangle)
+        :param vector: Array of shape (k, 256) with elements from T_q
+
+        :return: Array of shape (rows, 256) with the products in T_q
+        """
+        rows, k = array.shape[0], array.shape[1]
+        assert array.shape[2:] == (2, 128), f"Shape of array must be {(rows, k, 2, 128)}. Not {array.shape}."
+        assert vector.shape == (k, 256), f"Shape of vector must be {(k, 256)}. Not {vector.shape}."
+
+        # The native kernel is the fastest backend and goes first. It is built for q = 3329 and k <= 4 and reads an
+        # int16 matrix (KPke caches A that way) in place, transposed views included, anything else is converted first
+        if HAS_NATIVE and self.q == 3329 and k <= 4:
+            if array.dtype != np.int16 or array.strides[2:] != (256, 2) or min(array.strides[:2]) < 0:
+                array = np.ascontiguousarray(array, dtype=np.int16)
+            h_cap = np.empty((rows, 256), dtype=np.int32)
+            matvec(h_cap, array, np.ascontiguousarray(vector, dtype=np.int32), self.gammas_mont)
+            return h_cap
+
+        if USE_NUMBA:
+            h_cap = np.empty((rows, 256), dtype=np.int32)
+            _batched_basemul(np.asarray(array), np.ascontiguousarray(vector, dtype=np.int32),
+                             self.gammas, self.q, self.barrett_m, h_cap)
+            return h_cap
+
+        a = np.asarray(array, dtype=np.int64)
+        b = np.asarray(vector, dtype=np.int64).reshape(k, 128, 2)
+        a0, a1 = a[:, :, 0], a[:, :, 1]
+        b0, b1 = b[..., 0], b[..., 1]
+        h_cap = np.empty((rows, 128, 2), dtype=np.int64)
+        h_cap[..., 0] = (a0 * b0 + (a1 * b1 % self.q) * self.gammas).sum(axis=1)
+        h_cap[..., 1] = (a0 * b1 + a1 * b0).sum(axis=1)
+        return (h_cap % self.q).astype(np.int32).reshape(rows, 256)
 
     def get_sample_ntt(self, byte_array):
         """
@@ -110,19 +222,20 @@ class NTT:
         assert len(byte_array) == 34, f"The byte array must be 34 bytes in length. Not {len(byte_array)}."
         shake = SHAKE128.new()
         shake.update(byte_array)
-        a = [0] * 256
+        accepted = []
         j = 0
         while j < 256:
-            c = shake.read(3)
-            d1 = c[0] + 256 * (c[1] % 16)
-            d2 = (c[1] // 16) + 16 * c[2]
-            if d1 < self.q:
-                a[j] = d1
-                j += 1
-            if d2 < self.q and j < 256:
-                a[j] = d2
-                j += 1
-        return a
+            # Squeeze whole SHAKE128 blocks and parse every 3-byte group at once, the stream is the same as
+            # reading 3 bytes at a time
+            c = np.frombuffer(shake.read(3 * 168), dtype=np.uint8).astype(np.int32).reshape(-1, 3)
+            d = np.empty((len(c), 2), dtype=np.int32)
+            d[:, 0] = c[:, 0] + 256 * (c[:, 1] & 15)
+            d[:, 1] = (c[:, 1] >> 4) + 16 * c[:, 2]
+            d = d.reshape(-1)
+            d = d[d < self.q]
+            accepted.append(d)
+            j += len(d)
+        return np.concatenate(accepted)[:256]
 
     def get_sample_polyCBD(self, byte_array, eta):
         """
@@ -138,10 +251,7 @@ class NTT:
         assert len(byte_array) == expected_length, f"The byte array must be of length {expected_length}."
         f"Not {len(byte_array)}"
 
-        bit_array = bytes_to_bits(byte_array)
-        f = [0] * 256
-        for i in range(256):
-            x = sum(bit_array[2 * i * eta + j] for j in range(eta))
-            y = sum(bit_array[2 * i * eta + eta + j] for j in range(eta))
-            f[i] = (x - y) % self.q
-        return f
+        # Coefficient i takes the bits [2 * i * eta, 2 * (i + 1) * eta), the first eta count positive
+        bits = np.unpackbits(np.frombuffer(byte_array, dtype=np.uint8), bitorder='little').reshape(256, 2, eta)
+        counts = bits.sum(axis=2, dtype=np.int32)
+        return (counts[:, 0] - counts[:, 1]) % self.q
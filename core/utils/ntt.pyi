@@ -1,6 +1,13 @@
 from typing import List, Tuple
+
+import numpy as np
+
 import core.constants_ as cons
 
+def barrett_reduce(x: np.ndarray) -> np.ndarray: ...
+
+def tangle(f_cap: np.ndarray) -> np.ndarray: ...
+
 class NTT:
     def __init__(self, const: cons) -> None:
         self.zeta_values: Tuple[int] = None
@@ -8,16 +15,22 @@ class NTT:
         self.n: int = None
         self.q: int = None
         self.eta: int = None
+        self.zetas: np.ndarray = None
+        self.gammas: np.ndarray = None
+        self.gammas_mont: np.ndarray = None
+        self.barrett_m: int = None
+
+    def ntt(self, f: List[int] | np.ndarray) -> np.ndarray: ...
 
-    def ntt(self, f: List[int]) -> List[int]: ...
+    def ntt_inverse(self, f_cap: List[int] | np.ndarray) -> np.ndarray: ...
 
-    def ntt_inverse(self, f_cap: List[int]) -> List[int]: ...
+    def multiply_ntt(self, f_cap: List[int] | np.ndarray, g_cap: List[int] | np.ndarray) -> np.ndarray: ...
 
-    def multiply_ntt(self, f_cap: List[int], g_cap: List[int]) -> List[int]: ...
+    def batched_multiply_ntt(self, array: np.ndarray, vector: np.ndarray) -> np.ndarray: ...
 
-    def get_sample_ntt(self, byte_array: bytes) -> List[int]: ...
+    def get_sample_ntt(self, byte_array: bytes) -> np.ndarray: ...
 
-    def get_sample_polyCBD(self, byte_array: bytes, eta: int) -> List[int]: ...
+    def get_sample_polyCBD(self, byte_array: bytes, eta: int) -> np.ndarray: ...
 
     def _base_case_multiply(self, a0:int, a1:int, b0:int, b1:int, zeta:int) -> Tuple[int, int]: ...
 
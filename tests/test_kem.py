@@ -0,0 +1,148 @@
+import contextlib
+import ctypes
+import hashlib
+import importlib
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from core.subroutines.ML_KEM_Internal import ML_KEM_Internal
+from core.utils import bits, jit, native, ntt
+from core.utils import hash as hash_utils
+
+# sha256(ek || dk || K || c || K') for d, z, m = bytes 0..31, 32..63, 64..95, where K' is the implicit rejection key of
+# c with its first bit flipped. Computed with the original pure Python implementation
+KNOWN_ANSWERS = {
+    'kem512': 'cbd63e1533d753f503051b845e2ff2033b1979f960f40078c7b1441d5833854f',
+    'kem768': 'e02c147574f16e10458f18fb70ee0276804423ff335fe76386a95ef960c562f5',
+    'kem1024': '7dad1f21361df7f73c0221d31a7045b09502bfe7a6cb139c1b53fc4318ffd61b',
+}
+
+# (USE_NUMBA, HAS_NATIVE, AVX2 paths of the native library) of every backend, numpy is the reference the others
+# are compared against
+BACKENDS = {
+    'numpy': (False, False, False),
+    'numba': (True, False, False),
+    'native': (False, True, True),
+    'native-scalar': (False, True, False),
+}
+
+
+def run_kem(params_set):
+    """
+    Runs keygen, encapsulation and decapsulation of a valid and a tampered cipher text with fixed seeds
+
+    :param params_set: Name of the parameter set module in core.constants
+
+    :return: The hex digest of ek || dk || K || c || K' and whether decapsulation recovered K
+    """
+    const = importlib.import_module(f'core.constants.{params_set}')
+    ek, dk = ML_KEM_Internal(const).keygen(bytes(range(32)), bytes(range(32, 64)))
+    key, cipher = ML_KEM_Internal(const).encapsulation(bytes(range(64, 96)), ek)
+    decapsulated = ML_KEM_Internal(const).decapsulation(cipher, dk)
+    rejected = ML_KEM_Internal(const).decapsulation(bytes([cipher[0] ^ 1]) + cipher[1:], dk)
+    return hashlib.sha256(ek + dk + key + cipher + rejected).hexdigest(), decapsulated == key
+
+
+@contextlib.contextmanager
+def force_backend(name):
+    """
+    Patches the dispatch flags of ntt, bits and hash so only the given backend is taken
+
+    :param name: Key of BACKENDS
+    """
+    use_numba, has_native, avx2 = BACKENDS[name]
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(mock.patch.multiple(ntt, USE_NUMBA=use_numba, HAS_NATIVE=has_native))
+        stack.enter_context(mock.patch.object(bits, 'USE_NUMBA', use_numba))
+        stack.enter_context(mock.patch.object(hash_utils, 'HAS_NATIVE', has_native))
+        if has_native:
+            use_avx2 = ctypes.c_int.in_dll(native._lib, 'kyber_use_avx2')
+            saved = use_avx2.value
+            use_avx2.value = avx2
+            stack.callback(setattr, use_avx2, 'value', saved)
+        yield
+
+
+def available_backends():
+    """
+    :return: The backends that can run here, Numba needs PQC_NUMBA=1, native the built _kyber_native library and its
+        AVX2 paths a cpu with AVX2
+    """
+    backends = ['numpy'] + (['numba'] if jit.USE_NUMBA else [])
+    if native.HAS_NATIVE:
+        backends += (['native'] if native._lib.kyber_has_avx2() else []) + ['native-scalar']
+    return backends
+
+
+class KnownAnswerTest(unittest.TestCase):
+    def test_known_answers(self):
+        for params_set, expected in KNOWN_ANSWERS.items():
+            with self.subTest(params_set=params_set):
+                digest, recovered = run_kem(params_set)
+                self.assertEqual(digest, expected)
+                self.assertTrue(recovered)
+
+
+class BackendTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.ntt = ntt.NTT(importlib.import_module('core.constants.kem1024'))
+        self.array = np.ascontiguousarray(ntt.tangle(rng.integers(0, 3329, (4, 4, 256))), dtype=np.int16)
+        self.array.flags.writeable = False
+        self.vector = rng.integers(0, 3329, (4, 256)).astype(np.int32)
+        self.coefficients = rng.integers(0, 3329, 256).astype(np.int32)
+
+    def _products(self):
+        # A y, A^T y and a vector vector product, the three shapes KPke multiplies
+        return (self.ntt.batched_multiply_ntt(self.array, self.vector),
+                self.ntt.batched_multiply_ntt(self.array.transpose(1, 0, 2, 3), self.vector),
+                self.ntt.batched_multiply_ntt(ntt.tangle(self.vector)[np.newaxis], self.vector))
+
+    def _compressed(self):
+        result = []
+        for d in (1, 4, 5, 10, 11):
+            out = bytearray(32 * d)
+            bits.compress_encode_into(self.coefficients, d, out)
+            result.append((bytes(out), bits.decompress_decode(bytes(out), d).tolist()))
+        return result
+
+    def test_backends_agree(self):
+        with force_backend('numpy'):
+            expected_products = self._products()
+            expected_compressed = self._compressed()
+
+        for name in available_backends():
+            with self.subTest(backend=name), force_backend(name):
+                for product, expected in zip(self._products(), expected_products):
+                    np.testing.assert_array_equal(product, expected)
+                self.assertEqual(self._compressed(), expected_compressed)
+                self.assertEqual(run_kem('kem768'), (KNOWN_ANSWERS['kem768'], True))
+
+    def test_prf_x4_matches_prf(self):
+        seed = bytes(range(32))
+        for name in available_backends():
+            for eta, count in ((2, 1), (2, 4), (3, 3)):
+                with self.subTest(backend=name, eta=eta, count=count), force_backend(name):
+                    nonces = [bytes([n]) for n in range(count)]
+                    expected = [hash_utils.prf(seed, b, eta) for b in nonces]
+                    self.assertEqual(hash_utils.prf_x4(seed, nonces, eta), expected)
+
+    def test_backends_reject_the_same_inputs(self):
+        for name in available_backends():
+            with self.subTest(backend=name), force_backend(name):
+                with self.assertRaises(ValueError):
+                    bits.compress_encode_into(self.coefficients, 12, bytearray(384))
+                with self.assertRaises(ValueError):
+                    bits.decompress_decode(bytes(384), 12)
+                with self.assertRaises(AssertionError):
+                    bits.compress_encode_into(self.coefficients[:255], 4, bytearray(128))
+                with self.assertRaises(AssertionError):
+                    bits.decompress_decode(bytes(127), 4)
+                with self.assertRaises(TypeError):
+                    bits.compress_encode_into(self.coefficients, 4, bytes(128))
+
+
+if __name__ == '__main__':
+    unittest.main()